@@ -0,0 +1,73 @@
+"""
+Compare direct and write-behind upserts for a small-write workload.
+
+docker-compose up -d
+python3 benchmarks/write_behind.py
+"""
+
+import asyncio
+import functools
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from embedbase_qdrant import Qdrant
+
+DATASET = "benchmark_write_behind"
+REQUESTS = 2_000
+ROWS_PER_REQUEST = 3
+
+
+def _small_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        [
+            {
+                "data": "Bob is a human",
+                "embedding": np.random.rand(1536).tolist(),
+                "id": str(uuid.uuid4()),
+                "hash": "hash",
+                "metadata": {"source": "benchmark"},
+            }
+            for _ in range(ROWS_PER_REQUEST)
+        ],
+        columns=["data", "embedding", "id", "hash", "metadata"],
+    )
+
+
+async def _run(vector_database: Qdrant, label: str):
+    dfs = [_small_df() for _ in range(REQUESTS)]
+    await vector_database.clear(DATASET)
+    upserts = 0
+    upsert = vector_database.client.upsert
+
+    @functools.wraps(upsert)
+    def _counting_upsert(**kwargs):
+        nonlocal upserts
+        upserts += 1
+        return upsert(**kwargs)
+
+    vector_database.client.upsert = _counting_upsert
+    start = time.perf_counter()
+    for df in dfs:
+        await vector_database.update(df, DATASET)
+    await vector_database.flush()
+    elapsed = time.perf_counter() - start
+    vector_database.client.upsert = upsert
+    print(
+        f"{label:>12}: {REQUESTS / elapsed:8.1f} update calls/s, "
+        f"{REQUESTS * ROWS_PER_REQUEST / elapsed:8.1f} rows/s, "
+        f"{upserts} qdrant upserts"
+    )
+
+
+async def main():
+    await _run(Qdrant(), "direct")
+    buffered = Qdrant(write_behind=True, flush_size=1000, flush_interval=1.0)
+    await _run(buffered, "write-behind")
+    await buffered.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
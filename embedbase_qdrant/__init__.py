@@ -1 +1,3 @@
 from .qdrant_db import Qdrant
+from .resilience import CircuitOpenError
+from .write_behind import BufferFullError
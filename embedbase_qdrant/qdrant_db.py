@@ -1,6 +1,8 @@
 import asyncio
+import atexit
+import math
 from embedbase.database import VectorDatabase
-from typing import Union, List, Optional
+from typing import Any, Dict, Union, List, Optional
 from pandas import DataFrame
 from embedbase.utils import BatchGenerator
 from qdrant_client import QdrantClient
@@ -19,6 +21,8 @@ from qdrant_client.http.exceptions import UnexpectedResponse
 import itertools
 from embedbase.database.base import SearchResponse, SelectResponse, Dataset
 from typing import Callable, TypeVar
+from .resilience import CircuitBreaker, ResilientCaller, is_transient
+from .write_behind import WriteBehindBuffer
 
 T = TypeVar("T")
 
@@ -36,8 +40,8 @@ class Qdrant(VectorDatabase):
 
     client: QdrantClient
 
-    def _try_or_create_collection(
-        self, dataset_id: str, func: Callable[[], T], kwargs
+    async def _try_or_create_collection(
+        self, dataset_id: str, func: Callable[..., T], kwargs: Dict[str, Any]
     ) -> T:
         """
         Try to run the Qdrant function and if it fails, create the collection and try again.
@@ -45,34 +49,147 @@ class Qdrant(VectorDatabase):
         :param func: function to run
         """
         try:
-            return func(**kwargs)
+            return await self._caller.call(func, **kwargs)
         except UnexpectedResponse as exc:
             if exc.status_code != 404:
                 raise exc
-            self.client.create_collection(
+        # concurrent batches of a new dataset must create the collection only once
+        async with self._collection_lock(dataset_id):
+            try:
+                # it may have been created while waiting for the lock
+                return await self._caller.call(func, **kwargs)
+            except UnexpectedResponse as exc:
+                if exc.status_code != 404:
+                    raise exc
+            await self._caller.call(
+                self._client("create_collection").create_collection,
+                idempotent=False,
                 collection_name=dataset_id,
                 vectors_config=VectorParams(
                     size=self._dimensions, distance=Distance.COSINE
                 ),
             )
             self._collections.add(dataset_id)
-            return func(**kwargs)
+        return await self._caller.call(func, **kwargs)
 
-    def __init__(self, host: str = "localhost", port: int = 6333, **kwargs):
+    def _client(self, operation: str) -> QdrantClient:
+        """
+        :param operation: client method name
+        :return: client whose HTTP timeout is the deadline of the operation
+        """
+        return self._clients[self._caller.timeout(operation)]
+
+    def _collection_lock(self, dataset_id: str) -> asyncio.Lock:
+        if dataset_id not in self._collection_locks:
+            self._collection_locks[dataset_id] = asyncio.Lock()
+        return self._collection_locks[dataset_id]
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6333,
+        write_behind: bool = False,
+        flush_size: int = 1000,
+        flush_interval: float = 1.0,
+        max_pending: Optional[int] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        retries: int = 2,
+        hedge_after: Optional[float] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        max_concurrency: int = 16,
+        **kwargs,
+    ):
         """
 
         :param host: qdrant host
         :param port: qdrant port
+        :param write_behind: buffer updates and upsert them in large batches,
+            updated documents may not be visible before the next flush
+        :param flush_size: number of buffered documents in a dataset that triggers a flush
+        :param flush_interval: max seconds a document stays buffered
+        :param max_pending: max number of buffered documents, 10 * flush_size if None,
+            updates fail with BufferFullError beyond it
+        :param timeouts: seconds allowed per call including retries and waiting for
+            a free slot, by client method name (e.g. "search")
+        :param retries: retries of idempotent calls failing with a transient error
+        :param hedge_after: seconds before a slow search or select is sent a second time,
+            hedging is disabled if None
+        :param failure_threshold: consecutive calls failing after all their retries
+            after which calls fail fast
+        :param reset_timeout: seconds before calls are tried again after failing fast
+        :param max_concurrency: max number of qdrant calls running at once
         """
 
         super().__init__(**kwargs)
 
-        self.client = QdrantClient(host=host, port=port)
+        self._caller = ResilientCaller(
+            timeouts=timeouts,
+            retries=retries,
+            hedge_after=hedge_after,
+            circuit_breaker=CircuitBreaker(
+                failure_threshold=failure_threshold, reset_timeout=reset_timeout
+            ),
+            max_concurrency=max_concurrency,
+        )
+        # one client per deadline so that abandoned requests end at their deadline,
+        # the client only takes whole seconds so sub-second deadlines get a 1s timeout
+        self._clients = {
+            timeout: QdrantClient(host=host, port=port, timeout=math.ceil(timeout))
+            for timeout in set(self._caller.timeouts.values())
+        }
+        self.client = self._client("upsert")
         self._collections = set()
-        cols = self.client.get_collections().collections
+        self._collection_locks: Dict[str, asyncio.Lock] = {}
+        cols = self._client("get_collections").get_collections().collections
         for col in cols:
             self._collections.add(col.name)
         print(f"Qdrant collections: {self._collections}")
+        self._write_buffer: Optional[WriteBehindBuffer] = None
+        if write_behind:
+            self._write_buffer = WriteBehindBuffer(
+                self._upsert,
+                flush_size=flush_size,
+                flush_interval=flush_interval,
+                max_pending=max_pending,
+                retry_if=is_transient,
+            )
+            # do not lose buffered documents when the process stops
+            atexit.register(self._flush_at_exit)
+
+    def _flush_at_exit(self):
+        if self._write_buffer is not None:
+            asyncio.run(self._write_buffer.flush())
+
+    async def _upsert(
+        self, dataset_id: str, points: List[PointStruct]
+    ) -> None:
+        """
+        Upsert points, creating the collection if needed
+        :param dataset_id: dataset id
+        :param points: points to upsert
+        """
+        await self._try_or_create_collection(
+            dataset_id=dataset_id,
+            func=self._client("upsert").upsert,
+            kwargs={"collection_name": dataset_id, "points": points},
+        )
+
+    async def flush(self):
+        """
+        Write all buffered documents to qdrant
+        """
+        if self._write_buffer is not None:
+            await self._write_buffer.flush()
+
+    async def close(self):
+        """
+        Flush buffered documents and stop buffering
+        """
+        if self._write_buffer is not None:
+            await self._write_buffer.flush()
+            atexit.unregister(self._flush_at_exit)
+            self._write_buffer = None
 
     async def _multi_collections_scroll(
         self,
@@ -94,7 +211,9 @@ class Qdrant(VectorDatabase):
         # scroll multiple collections in parallel
 
         async def _scroll(collection_name: str) -> List[Record]:
-            records, _ = self.client.scroll(
+            records, _ = await self._caller.call(
+                self._client("scroll").scroll,
+                hedge=True,
                 collection_name=collection_name,
                 query_filter=query_filter,
                 with_payload=with_payload,
@@ -182,7 +301,16 @@ class Qdrant(VectorDatabase):
         batch_size: Optional[int] = 100,
         # todo: implement store_data someday
         store_data: bool = True,
+        wait: bool = False,
     ):
+        """
+        :param df: dataframe
+        :param dataset_id: dataset id
+        :param user_id: user id
+        :param batch_size: batch size
+        :param store_data: store data in database?
+        :param wait: with write_behind, wait until the documents are written to qdrant
+        """
         df_batcher = BatchGenerator(batch_size)
         batches = [batch_df for batch_df in df_batcher(df)]
 
@@ -202,12 +330,9 @@ class Qdrant(VectorDatabase):
                 for _, row in batch_df.iterrows()
             ]
 
-            response = self._try_or_create_collection(
-                dataset_id=dataset_id,
-                func=self.client.upsert,
-                kwargs={"collection_name": dataset_id, "points": points},
-            )
-            return response
+            if self._write_buffer is not None:
+                return await self._write_buffer.add(dataset_id, points, wait=wait)
+            return await self._upsert(dataset_id, points)
 
         await asyncio.gather(*[_insert(batch_df) for batch_df in batches])
 
@@ -217,6 +342,8 @@ class Qdrant(VectorDatabase):
         dataset_id: str,
         user_id: Optional[str] = None,
     ):
+        if self._write_buffer is not None:
+            await self._write_buffer.discard(dataset_id, ids=ids, user_id=user_id)
         must = [
             HasIdCondition(has_id=ids),
         ]
@@ -225,7 +352,8 @@ class Qdrant(VectorDatabase):
                 FieldCondition(key="user_id", range=MatchValue(value="user_id"))
             )
         try:
-            self.client.delete(
+            await self._caller.call(
+                self._client("delete").delete,
                 wait=True,
                 collection_name=dataset_id,
                 points_selector=FilterSelector(
@@ -246,7 +374,22 @@ class Qdrant(VectorDatabase):
         dataset_ids: List[str],
         user_id: Optional[str] = None,
         where: Optional[Union[dict, List[dict]]] = None,
+        group_by: Optional[str] = None,
+        group_size: int = 1,
     ):
+        """
+        :param vector: vector the similarity is calculated against
+        :param top_k: top k number of results returned, or of groups when grouping
+        :param dataset_ids: dataset ids
+        :param user_id: user id
+        :param where: where condition to filter results
+        :param group_by: metadata key to group results by, e.g. a source document id,
+            documents without this key are left out of the results
+        :param group_size: number of results returned per group, requires group_by
+        :return: list of documents, best groups first
+        """
+        assert group_size >= 1, "group_size must be at least 1"
+        assert group_by or group_size == 1, "group_size requires group_by"
         if where:
             raise NotImplementedError("where is not implemented yet in embedbase-qdrant")
         must = []
@@ -254,18 +397,33 @@ class Qdrant(VectorDatabase):
             must.append(
                 FieldCondition(key="user_id", range=MatchValue(value="user_id"))
             )
+        kwargs: Dict[str, Any] = {
+            # TODO: does not support cross-collection search atm
+            "collection_name": dataset_ids[0],
+            "query_vector": vector,
+            "limit": top_k,
+            "query_filter": Filter(
+                must=must,
+            ),
+            "with_vectors": True,
+            "with_payload": True,
+        }
         try:
-            search_result = self.client.search(
-                # TODO: does not support cross-collection search atm
-                collection_name=dataset_ids[0],
-                query_vector=vector,
-                limit=top_k,
-                query_filter=Filter(
-                    must=must,
-                ),
-                with_vectors=True,
-                with_payload=True,
-            )
+            if group_by:
+                groups_result = await self._caller.call(
+                    self._client("search_groups").search_groups,
+                    hedge=True,
+                    group_by=f"metadata.{group_by}",
+                    group_size=group_size,
+                    **kwargs,
+                )
+                search_result = [
+                    hit for group in groups_result.groups for hit in group.hits
+                ]
+            else:
+                search_result = await self._caller.call(
+                    self._client("search").search, hedge=True, **kwargs
+                )
         except UnexpectedResponse as exc:
             # ignore unexisting collections
             if exc.status_code != 404:
@@ -290,13 +448,16 @@ class Qdrant(VectorDatabase):
         :param dataset_id: dataset id
         :param user_id: user id
         """
+        if self._write_buffer is not None:
+            await self._write_buffer.discard(dataset_id, user_id=user_id)
         must = []
         if user_id:
             must.append(
                 FieldCondition(key="user_id", range=MatchValue(value="user_id"))
             )
         try:
-            self.client.delete(
+            await self._caller.call(
+                self._client("delete").delete,
                 wait=True,
                 collection_name=dataset_id,
                 points_selector=FilterSelector(filter=Filter(must=must)),
@@ -316,11 +477,14 @@ class Qdrant(VectorDatabase):
             must.append(
                 FieldCondition(key="user_id", range=MatchValue(value="user_id"))
             )
-        result = self.client.get_collections()
+        result = await self._caller.call(
+            self._client("get_collections").get_collections
+        )
         response = []
         # todo: parallelize
         for e in result.collections:
-            count = self.client.count(
+            count = await self._caller.call(
+                self._client("count").count,
                 collection_name=e.name,
                 count_filter=Filter(
                     must=must,
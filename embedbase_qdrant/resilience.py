@@ -0,0 +1,324 @@
+import asyncio
+import functools
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+T = TypeVar("T")
+
+DEFAULT_TIMEOUTS = {
+    "search": 5.0,
+    "search_groups": 5.0,
+    "scroll": 10.0,
+    "count": 10.0,
+    "get_collections": 10.0,
+    "upsert": 30.0,
+    "delete": 30.0,
+    "create_collection": 30.0,
+}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling qdrant while the circuit breaker is open
+    """
+
+
+class CircuitBreaker:
+    """
+    Stop calling qdrant after ``failure_threshold`` consecutive transient failures.
+    After ``reset_timeout`` seconds a single probe call is let through,
+    closing the circuit again if it succeeds.
+    """
+
+    def __init__(
+        self, failure_threshold: int = 5, reset_timeout: float = 30.0
+    ) -> None:
+        """
+        :param failure_threshold: consecutive failures opening the circuit
+        :param reset_timeout: seconds before a probe call is allowed
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self._reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> None:
+        """
+        :raises CircuitOpenError: if the call must not reach qdrant
+        """
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return
+        raise CircuitOpenError(
+            f"qdrant circuit is open after {self._failures} consecutive failures"
+        )
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def release_probe(self) -> None:
+        """
+        Let another call probe qdrant when a probe ended without an outcome
+        """
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self._failures >= self._failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    Whether an error may go away by retrying the same call
+    :param exc: error raised by a qdrant call
+    """
+    if isinstance(exc, CircuitOpenError):
+        return True
+    if isinstance(exc, UnexpectedResponse):
+        return (
+            exc.status_code is None
+            or exc.status_code >= 500
+            or exc.status_code == 429
+        )
+    if isinstance(exc, ResponseHandlingException):
+        # validation errors wrap a ValueError, transport errors do not
+        return not isinstance(exc.source, ValueError)
+    return isinstance(exc, (asyncio.TimeoutError, ConnectionError))
+
+
+class ResilientCaller:
+    """
+    Run blocking qdrant client calls off the event loop with a deadline per operation,
+    jittered retries of transient failures, a circuit breaker and optional hedging.
+    The deadline bounds the whole call: waiting for one of the ``max_concurrency``
+    threads, every attempt and the backoff between them.
+    """
+
+    def __init__(
+        self,
+        timeouts: Optional[Dict[str, float]] = None,
+        retries: int = 2,
+        backoff: float = 0.1,
+        max_backoff: float = 2.0,
+        hedge_after: Optional[float] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        max_concurrency: int = 16,
+    ) -> None:
+        """
+        :param timeouts: seconds allowed per call including its retries,
+            by client method name
+        :param retries: retries of idempotent calls failing with a transient error
+        :param backoff: base of the exponential backoff between retries, in seconds
+        :param max_backoff: max backoff between retries, in seconds
+        :param hedge_after: seconds before a hedged call is sent a second time,
+            hedging is disabled if None
+        :param circuit_breaker: circuit breaker shared by all calls,
+            counting one failure per call once its retries are exhausted
+        :param max_concurrency: max number of calls running at once
+        """
+        self._timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._hedge_after = hedge_after
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self._max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="qdrant"
+        )
+        # semaphores are bound to the event loop they are used in
+        self._slots: Optional[
+            Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]
+        ] = None
+
+    @property
+    def timeouts(self) -> Dict[str, float]:
+        return dict(self._timeouts)
+
+    def timeout(self, operation: str) -> float:
+        """
+        :param operation: client method name
+        :return: seconds allowed per call
+        """
+        return self._timeouts.get(operation, self._timeouts["get_collections"])
+
+    async def call(
+        self,
+        func: Callable[..., T],
+        *args: Any,
+        idempotent: bool = True,
+        hedge: bool = False,
+        **kwargs: Any,
+    ) -> T:
+        """
+        Call a qdrant client method
+        :param func: client method
+        :param idempotent: whether the call can safely be retried
+        :param hedge: send the call again if it is slower than hedge_after
+        :return: result of the call
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout(getattr(func, "__name__", ""))
+        retries = self._retries if idempotent else 0
+        self.circuit_breaker.before_call()
+        attempt = 0
+        while True:
+            try:
+                if hedge and self._hedge_after is not None:
+                    result = await self._hedged(
+                        func, args, kwargs, deadline, self._hedge_after
+                    )
+                else:
+                    future = await self._run(func, args, kwargs, deadline)
+                    result = await asyncio.wait_for(future, deadline - loop.time())
+            except Exception as exc:
+                if not is_transient(exc):
+                    # qdrant answered, it is healthy
+                    self.circuit_breaker.record_success()
+                    raise
+                # full jitter
+                backoff = random.uniform(
+                    0, min(self._max_backoff, self._backoff * 2**attempt)
+                )
+                # do not retry past the deadline
+                if attempt >= retries or loop.time() + backoff >= deadline:
+                    self.circuit_breaker.record_failure()
+                    raise
+                attempt += 1
+                try:
+                    await asyncio.sleep(backoff)
+                except BaseException:
+                    self.circuit_breaker.release_probe()
+                    raise
+            except BaseException:
+                # cancelled, e.g. by the caller's own timeout: the outcome is unknown
+                self.circuit_breaker.release_probe()
+                raise
+            else:
+                self.circuit_breaker.record_success()
+                return result
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots[0] is not loop:
+            self._slots = (loop, asyncio.Semaphore(self._max_concurrency))
+        return self._slots[1]
+
+    async def _run(
+        self,
+        func: Callable[..., T],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        deadline: float,
+    ) -> "asyncio.Future[T]":
+        """
+        Start the call in the thread pool once a slot is free
+        :raises asyncio.TimeoutError: if no slot is free before the deadline
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphore()
+        await asyncio.wait_for(semaphore.acquire(), deadline - loop.time())
+        return self._submit(func, args, kwargs, semaphore)
+
+    def _submit(
+        self,
+        func: Callable[..., T],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        semaphore: asyncio.Semaphore,
+    ) -> "asyncio.Future[T]":
+        """
+        Start the call in the thread pool, holding an acquired slot.
+        The slot is only released when the thread is done, even if the caller gave up,
+        so that abandoned calls do not make the next ones queue in the pool.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        try:
+            concurrent_future = self._executor.submit(call)
+        except RuntimeError:
+            semaphore.release()
+            # no new threads once the interpreter shuts down, e.g. when flushing at exit
+            future: "asyncio.Future[T]" = loop.create_future()
+            try:
+                future.set_result(call())
+            except Exception as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+            return future
+        concurrent_future.add_done_callback(
+            lambda _: _release_threadsafe(loop, semaphore)
+        )
+        return asyncio.wrap_future(concurrent_future, loop=loop)
+
+    async def _hedged(
+        self,
+        func: Callable[..., T],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        deadline: float,
+        hedge_after: float,
+    ) -> T:
+        """
+        Send the call, and once more if no answer came after hedge_after seconds
+        and a slot is free, returning the first successful answer within the deadline
+        """
+        loop = asyncio.get_running_loop()
+        pending = {await self._run(func, args, kwargs, deadline)}
+        try:
+            done, _ = await asyncio.wait(
+                pending, timeout=min(hedge_after, max(0, deadline - loop.time()))
+            )
+            semaphore = self._semaphore()
+            # waiting for a slot would defeat the purpose of hedging
+            if not done and not semaphore.locked():
+                await semaphore.acquire()
+                pending.add(self._submit(func, args, kwargs, semaphore))
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(0, deadline - loop.time()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for future in done:
+                    error = future.exception()
+                    if error is None:
+                        return future.result()
+            assert error is not None
+            raise error
+        finally:
+            # the slower call keeps running in its thread, its answer is ignored
+            for future in pending:
+                future.cancel()
+
+
+def _release_threadsafe(
+    loop: asyncio.AbstractEventLoop, semaphore: asyncio.Semaphore
+) -> None:
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        # the event loop is closed, nobody waits for the semaphore anymore
+        pass
@@ -0,0 +1,280 @@
+import asyncio
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set, Union
+
+from qdrant_client.http.models import PointStruct
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFullError(Exception):
+    """
+    Raised instead of buffering points while too many writes are pending,
+    e.g. because qdrant is unavailable
+    """
+
+
+class _PendingWrites:
+    """
+    Points waiting to be upserted in a single dataset,
+    along with the callers waiting for them to be durable.
+    """
+
+    def __init__(self) -> None:
+        self.points: Dict[Union[int, str], PointStruct] = {}
+        # call to add each point comes from, to write them separately if needed
+        self.origins: Dict[Union[int, str], int] = {}
+        self.waiters: Dict[int, "asyncio.Future[None]"] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # a flush of these points was started
+        self.flushing = False
+        # these points failed to be written and wait for the timer to be retried
+        self.retrying = False
+
+
+class WriteBehindBuffer:
+    """
+    Coalesce many small upserts into a few large ones.
+    Points are grouped per dataset and de-duplicated by id (last write wins),
+    then handed to ``flush_func`` once ``flush_size`` points are pending
+    or ``flush_interval`` seconds after the first pending write.
+    Points of a failed flush are buffered again when ``retry_if`` accepts the error,
+    and retried after ``flush_interval`` seconds.
+    Otherwise the points of each call to ``add`` are written separately,
+    so that a single bad write only drops its own points.
+    """
+
+    def __init__(
+        self,
+        flush_func: Callable[[str, List[PointStruct]], Awaitable[None]],
+        flush_size: int = 1000,
+        flush_interval: float = 1.0,
+        retry_if: Callable[[Exception], bool] = lambda exc: True,
+        max_pending: Optional[int] = None,
+    ):
+        """
+        :param flush_func: function upserting a list of points into a dataset
+        :param flush_size: number of pending points that triggers a flush
+        :param flush_interval: max seconds a point stays in the buffer
+        :param retry_if: whether the points of a flush failing with this error
+            are buffered again for the next flush
+        :param max_pending: max number of buffered points, 10 * flush_size if None
+        """
+        assert flush_size > 0, "flush_size must be positive"
+        max_pending = max_pending or 10 * flush_size
+        assert max_pending >= flush_size, "max_pending must be at least flush_size"
+        self._flush_func = flush_func
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._retry_if = retry_if
+        self._max_pending = max_pending
+        self._pending: Dict[str, _PendingWrites] = {}
+        self._flush_tasks: Set["asyncio.Task[None]"] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._adds = itertools.count()
+
+    def __len__(self) -> int:
+        return sum(len(p.points) for p in self._pending.values())
+
+    async def add(
+        self, dataset_id: str, points: List[PointStruct], wait: bool = False
+    ) -> None:
+        """
+        Buffer points for a dataset
+        :param dataset_id: dataset id
+        :param points: points to upsert
+        :param wait: wait until the points are written to qdrant
+        :raises BufferFullError: if buffering the points would exceed max_pending
+        """
+        if len(self) + len(points) > self._max_pending:
+            raise BufferFullError(
+                f"{len(self)} points are already waiting to be written to qdrant"
+            )
+        pending = self._pending.setdefault(dataset_id, _PendingWrites())
+        origin = next(self._adds)
+        for point in points:
+            pending.points[point.id] = point
+            pending.origins[point.id] = origin
+        waiter = None
+        if wait:
+            waiter = asyncio.get_running_loop().create_future()
+            pending.waiters[origin] = waiter
+        if (
+            len(pending.points) >= self._flush_size
+            and not pending.flushing
+            and not pending.retrying
+        ):
+            # in the background like timed flushes,
+            # the caller is only told about errors if it waits for the points
+            self._start_flush(dataset_id)
+        else:
+            self._schedule_flush(dataset_id)
+        if waiter is not None:
+            await waiter
+
+    async def discard(
+        self,
+        dataset_id: str,
+        ids: Optional[Sequence[Union[int, str]]] = None,
+        user_id: Optional[str] = None,
+    ) -> None:
+        """
+        Drop pending points so that a later flush does not bring back
+        documents that were deleted in the meantime,
+        waiting for a flush of the dataset in progress to be written first
+        :param dataset_id: dataset id
+        :param ids: ids to drop, all pending points of the dataset if None
+        :param user_id: only drop points belonging to this user
+        """
+        async with self._lock(dataset_id):
+            pending = self._pending.get(dataset_id)
+            if pending is None:
+                return
+            candidates: List[Union[int, str]] = (
+                list(pending.points.keys()) if ids is None else list(ids)
+            )
+            for point_id in candidates:
+                point = pending.points.get(point_id)
+                if point is None:
+                    continue
+                if user_id and (point.payload or {}).get("user_id") != user_id:
+                    continue
+                del pending.points[point_id]
+                del pending.origins[point_id]
+
+    async def flush(self, dataset_id: Optional[str] = None) -> None:
+        """
+        Write pending points now, including those of flushes already in progress
+        :param dataset_id: dataset id, all datasets if None
+        """
+        loop = asyncio.get_running_loop()
+        # tasks of a previous event loop (e.g. when flushing at exit) cannot be awaited
+        in_flight = [t for t in self._flush_tasks if t.get_loop() is loop]
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        dataset_ids = [dataset_id] if dataset_id else list(self._pending.keys())
+        error = None
+        for d in dataset_ids:
+            try:
+                await self._flush_dataset(d)
+            except Exception as exc:  # pylint: disable=broad-except
+                # keep flushing the other datasets before reporting the error
+                error = error or exc
+        if error is not None:
+            raise error
+
+    async def _flush_dataset(self, dataset_id: str) -> None:
+        # one flush at a time per dataset so that the last write wins
+        async with self._lock(dataset_id):
+            pending = self._pending.pop(dataset_id, None)
+            if pending is None:
+                return
+            if pending.timer is not None:
+                pending.timer.cancel()
+            try:
+                await self._write(dataset_id, list(pending.points.values()))
+            except Exception as exc:  # pylint: disable=broad-except
+                if not self._retry_if(exc):
+                    await self._write_separately(dataset_id, pending)
+                    return
+                self._requeue(dataset_id, pending, list(pending.points.values()))
+                _resolve(list(pending.waiters.values()), exc)
+                raise
+            _resolve(list(pending.waiters.values()))
+
+    async def _write(self, dataset_id: str, points: List[PointStruct]) -> None:
+        for i in range(0, len(points), self._flush_size):
+            await self._flush_func(dataset_id, points[i : i + self._flush_size])
+
+    async def _write_separately(self, dataset_id: str, pending: _PendingWrites) -> None:
+        """
+        Write the points of each call to add on their own,
+        so that an invalid point (e.g. a vector of the wrong size)
+        does not drop the other writes it was coalesced with
+        """
+        batches: Dict[int, List[PointStruct]] = {}
+        for point_id, point in pending.points.items():
+            batches.setdefault(pending.origins[point_id], []).append(point)
+        error: Optional[Exception] = None
+        for origin, points in batches.items():
+            waiter = pending.waiters.pop(origin, None)
+            try:
+                await self._write(dataset_id, points)
+            except Exception as exc:  # pylint: disable=broad-except
+                error = error or exc
+                if self._retry_if(exc):
+                    self._requeue(dataset_id, pending, points)
+                elif waiter is None:
+                    logger.error(
+                        f"Dropped {len(points)} pending writes to {dataset_id}: {exc}"
+                    )
+                _resolve([waiter] if waiter else [], exc)
+            else:
+                _resolve([waiter] if waiter else [])
+        # writes entirely replaced by later ones share the outcome of the flush
+        _resolve(list(pending.waiters.values()), error)
+        if error is not None:
+            raise error
+
+    def _lock(self, dataset_id: str) -> asyncio.Lock:
+        if dataset_id not in self._locks:
+            self._locks[dataset_id] = asyncio.Lock()
+        return self._locks[dataset_id]
+
+    def _requeue(
+        self, dataset_id: str, failed: _PendingWrites, points: List[PointStruct]
+    ) -> None:
+        pending = self._pending.setdefault(dataset_id, _PendingWrites())
+        for point in points:
+            # do not overwrite points written while flushing
+            if point.id not in pending.points:
+                pending.points[point.id] = point
+                pending.origins[point.id] = failed.origins[point.id]
+        # wait for the timer instead of retrying on every add while qdrant is down
+        pending.retrying = True
+        self._schedule_flush(dataset_id)
+
+    def _schedule_flush(self, dataset_id: str) -> None:
+        pending = self._pending[dataset_id]
+        if pending.timer is None:
+            pending.timer = asyncio.get_running_loop().call_later(
+                self._flush_interval, self._flush_on_timer, dataset_id
+            )
+
+    def _flush_on_timer(self, dataset_id: str) -> None:
+        pending = self._pending.get(dataset_id)
+        if pending is not None:
+            pending.timer = None
+            self._start_flush(dataset_id)
+
+    def _start_flush(self, dataset_id: str) -> None:
+        pending = self._pending[dataset_id]
+        pending.flushing = True
+        if pending.timer is not None:
+            pending.timer.cancel()
+            pending.timer = None
+        task = asyncio.ensure_future(self._flush_logged(dataset_id))
+        # keep a reference so that the task is not garbage collected mid-flush
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush_logged(self, dataset_id: str) -> None:
+        try:
+            await self._flush_dataset(dataset_id)
+        except Exception:  # pylint: disable=broad-except
+            # writes nobody awaits would otherwise fail silently
+            logger.exception(f"Failed to flush pending writes to {dataset_id}")
+
+
+def _resolve(
+    waiters: List["asyncio.Future[None]"], exc: Optional[Exception] = None
+) -> None:
+    for waiter in waiters:
+        # the waiter may belong to an event loop that is already gone (e.g. at exit)
+        if waiter.done() or waiter.get_loop().is_closed():
+            continue
+        if exc is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(exc)
@@ -2,6 +2,7 @@
 Unit tests special to Qdrant because of its specific API
 """
 
+import functools
 import hashlib
 from qdrant_client.http.models import (
     Filter,
@@ -52,4 +53,106 @@ async def test_multi_collections_scroll():
     )
     # we expect to get duplicates because we are searching through multiple collections
     assert len(results) == 4
-    assert len(set([result.id for result in results])) == 2
\ No newline at end of file
+    assert len(set([result.id for result in results])) == 2
+
+
+@pytest.mark.asyncio
+async def test_write_behind():
+    """
+    Test if small updates are coalesced and de-duplicated before being written
+    """
+    buffered_database = Qdrant(
+        host="localhost", port=6333, write_behind=True, flush_size=100
+    )
+    unit_testing_dataset = "unit_test_write_behind"
+    ids = [str(uuid.uuid4()) for _ in range(10)]
+    await buffered_database.clear(unit_testing_dataset)
+    upserted = []
+    upsert = buffered_database.client.upsert
+
+    @functools.wraps(upsert)
+    def _counting_upsert(**kwargs):
+        response = upsert(**kwargs)
+        # only count upserts reaching an existing collection
+        upserted.append(len(kwargs["points"]))
+        return response
+
+    buffered_database.client.upsert = _counting_upsert
+    # write each document twice, one row at a time
+    for i in range(20):
+        df = pd.DataFrame(
+            [
+                {
+                    "data": f"doc {i}",
+                    "embedding": np.random.rand(1536).tolist(),
+                    "id": ids[i % 10],
+                    "hash": hashlib.sha256(f"doc {i}".encode()).hexdigest(),
+                    "metadata": {"test": "test"},
+                }
+            ],
+            columns=["data", "embedding", "id", "hash", "metadata"],
+        )
+        await buffered_database.update(df, unit_testing_dataset, wait=i == 19)
+    # a single de-duplicated upsert
+    assert upserted == [10]
+    results = await buffered_database.select(
+        ids=ids, dataset_id=unit_testing_dataset
+    )
+    assert len(results) == 10
+    # last write wins
+    assert {result.data for result in results} == {f"doc {i}" for i in range(10, 20)}
+    await buffered_database.close()
+
+
+@pytest.mark.asyncio
+async def test_search_group_by():
+    """
+    Test if grouped search returns the best chunk of each source document
+    """
+    unit_testing_dataset = "unit_test_group_by"
+    embedding = np.random.rand(1536).tolist()
+    df = pd.DataFrame(
+        [
+            {
+                "data": f"chunk {chunk} of {source}",
+                "embedding": embedding,
+                "id": str(uuid.uuid4()),
+                "hash": hashlib.sha256(f"{source}{chunk}".encode()).hexdigest(),
+                "metadata": {"source": source},
+            }
+            for source in ["a", "b", "c"]
+            for chunk in range(5)
+        ],
+        columns=["data", "embedding", "id", "hash", "metadata"],
+    )
+    await vector_database.clear(unit_testing_dataset)
+    await vector_database.update(df, unit_testing_dataset)
+    results = await vector_database.search(
+        embedding,
+        top_k=3,
+        dataset_ids=[unit_testing_dataset],
+        group_by="source",
+    )
+    assert len(results) == 3
+    assert {result.metadata["source"] for result in results} == {"a", "b", "c"}
+    results = await vector_database.search(
+        embedding,
+        top_k=2,
+        dataset_ids=[unit_testing_dataset],
+        group_by="source",
+        group_size=2,
+    )
+    assert len(results) == 4
+    assert len({result.metadata["source"] for result in results}) == 2
+    with pytest.raises(AssertionError):
+        await vector_database.search(
+            embedding,
+            top_k=2,
+            dataset_ids=[unit_testing_dataset],
+            group_by="source",
+            group_size=0,
+        )
+    with pytest.raises(AssertionError):
+        await vector_database.search(
+            embedding, top_k=2, dataset_ids=[unit_testing_dataset], group_size=2
+        )
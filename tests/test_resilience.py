@@ -0,0 +1,181 @@
+"""
+Unit tests of the resilient call layer against a fault-injecting stand-in of the qdrant client
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+import pytest
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+from embedbase_qdrant.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientCaller,
+)
+
+
+class FaultyClient:
+    """
+    Stand-in for QdrantClient failing or stalling its first calls
+    """
+
+    def __init__(
+        self, failures: int = 0, error: Optional[Exception] = None, delay: float = 0
+    ):
+        self.failures = failures
+        self.error = error or ResponseHandlingException(httpx.ConnectError("refused"))
+        self.delay = delay
+        self.calls = 0
+
+    def search(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            if self.delay:
+                time.sleep(self.delay)
+            else:
+                raise self.error
+        return ["hit"]
+
+    def create_collection(self, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+@pytest.mark.asyncio
+async def test_retry_transient_errors():
+    client = FaultyClient(failures=2)
+    caller = ResilientCaller(retries=2, backoff=0.01)
+    assert await caller.call(client.search) == ["hit"]
+    assert client.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_do_not_retry_client_errors_nor_non_idempotent_calls():
+    not_found = UnexpectedResponse(404, "Not Found", b"", httpx.Headers())
+    client = FaultyClient(failures=1, error=not_found)
+    caller = ResilientCaller(retries=2, backoff=0.01)
+    with pytest.raises(UnexpectedResponse):
+        await caller.call(client.search)
+    assert client.calls == 1
+
+    client = FaultyClient(failures=1)
+    with pytest.raises(ResponseHandlingException):
+        await caller.call(client.create_collection, idempotent=False)
+    assert client.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_timeout():
+    client = FaultyClient(failures=1, delay=1)
+    caller = ResilientCaller(timeouts={"search": 0.1}, retries=0)
+    start = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        await caller.call(client.search)
+    assert time.monotonic() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_hedging():
+    # the first call stalls, the hedged one answers right away
+    client = FaultyClient(failures=1, delay=1)
+    caller = ResilientCaller(timeouts={"search": 0.5}, retries=0, hedge_after=0.05)
+    start = time.monotonic()
+    assert await caller.call(client.search, hedge=True) == ["hit"]
+    assert time.monotonic() - start < 0.5
+    assert client.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker():
+    client = FaultyClient(failures=3)
+    caller = ResilientCaller(
+        retries=0,
+        circuit_breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.1),
+    )
+    for _ in range(3):
+        with pytest.raises(ResponseHandlingException):
+            await caller.call(client.search)
+    assert caller.circuit_breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        await caller.call(client.search)
+    assert client.calls == 3
+    await asyncio.sleep(0.1)
+    assert await caller.call(client.search) == ["hit"]
+    assert caller.circuit_breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_counts_calls_not_attempts():
+    client = FaultyClient(failures=3)
+    caller = ResilientCaller(
+        retries=2,
+        backoff=0.01,
+        circuit_breaker=CircuitBreaker(failure_threshold=2, reset_timeout=10),
+    )
+    with pytest.raises(ResponseHandlingException):
+        await caller.call(client.search)
+    # three failed attempts are a single failed call
+    assert caller.circuit_breaker.state == "closed"
+    assert await caller.call(client.search) == ["hit"]
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_cancelled_probe():
+    client = FaultyClient(failures=2, delay=1)
+    caller = ResilientCaller(
+        retries=0,
+        timeouts={"search": 0.05},
+        circuit_breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.1),
+    )
+    with pytest.raises(asyncio.TimeoutError):
+        await caller.call(client.search)
+    await asyncio.sleep(0.1)
+    # the probe is cancelled by an outer timeout
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(caller.call(client.search), 0.01)
+    assert await caller.call(client.search) == ["hit"]
+    assert caller.circuit_breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_deadline_includes_waiting_for_a_slot():
+    client = FaultyClient(failures=1, delay=0.3)
+    caller = ResilientCaller(timeouts={"search": 0.2}, retries=0, max_concurrency=1)
+    stalled = asyncio.ensure_future(caller.call(client.search))
+    await asyncio.sleep(0.01)
+    start = time.monotonic()
+    # the stalled call holds the only thread past the deadline
+    with pytest.raises(asyncio.TimeoutError):
+        await caller.call(client.search)
+    assert time.monotonic() - start < 0.25
+    with pytest.raises(asyncio.TimeoutError):
+        await stalled
+
+
+@pytest.mark.asyncio
+async def test_deadline_includes_retries():
+    client = FaultyClient(failures=10)
+    caller = ResilientCaller(
+        timeouts={"search": 0.1}, retries=10, backoff=0.05, max_backoff=0.05
+    )
+    start = time.monotonic()
+    with pytest.raises(ResponseHandlingException):
+        await caller.call(client.search)
+    assert time.monotonic() - start < 0.15
+    assert client.calls < 10
+
+
+@pytest.mark.asyncio
+async def test_hedging_does_not_wait_for_a_slot():
+    client = FaultyClient(failures=1, delay=2)
+    caller = ResilientCaller(
+        timeouts={"search": 0.5}, retries=0, hedge_after=0.05, max_concurrency=1
+    )
+    start = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        await caller.call(client.search, hedge=True)
+    assert time.monotonic() - start < 0.7
+    assert client.calls == 1
@@ -0,0 +1,131 @@
+"""
+Unit tests of the write-behind buffer against a fake upsert function
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional, Union
+
+import pytest
+from qdrant_client.http.models import PointStruct
+
+from embedbase_qdrant.write_behind import BufferFullError, WriteBehindBuffer
+
+
+class FakeUpsert:
+    """
+    Stand-in for Qdrant._upsert failing its first calls
+    and rejecting vectors of the wrong size
+    """
+
+    def __init__(self, failures: int = 0, delay: float = 0):
+        self.failures = failures
+        self.delay = delay
+        self.calls: List[List[Union[int, str]]] = []
+        self.stored: Dict[Union[int, str], Optional[Dict[str, Any]]] = {}
+
+    async def __call__(self, dataset_id: str, points: List[PointStruct]) -> None:
+        self.calls.append([p.id for p in points])
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if len(self.calls) <= self.failures:
+            raise ConnectionError("qdrant is down")
+        if any(len(p.vector) != 2 for p in points):
+            raise ValueError("wrong vector size")
+        for point in points:
+            self.stored[point.id] = point.payload
+
+
+def points(
+    *ids: int, payload: Optional[Dict[str, Any]] = None, size: int = 2
+) -> List[PointStruct]:
+    return [PointStruct(id=i, vector=[0.0] * size, payload=payload) for i in ids]
+
+
+def not_value_error(exc: Exception) -> bool:
+    return not isinstance(exc, ValueError)
+
+
+@pytest.mark.asyncio
+async def test_size_triggered_flush():
+    upsert = FakeUpsert()
+    buffer = WriteBehindBuffer(upsert, flush_size=3, flush_interval=10)
+    await buffer.add("d", points(1, 2))
+    await buffer.add("d", points(2, payload={"v": "new"}))
+    assert upsert.calls == []
+    await buffer.add("d", points(3))
+    await asyncio.sleep(0)
+    assert upsert.calls == [[1, 2, 3]]
+    assert upsert.stored[2] == {"v": "new"}
+
+
+@pytest.mark.asyncio
+async def test_requeue_on_transient_error():
+    upsert = FakeUpsert(failures=1)
+    buffer = WriteBehindBuffer(upsert, flush_size=2, flush_interval=0.05)
+    # fire-and-forget callers are not told about errors of writes that are retried
+    await buffer.add("d", points(1, 2))
+    await asyncio.sleep(0.01)
+    assert len(upsert.calls) == 1
+    assert len(buffer) == 2
+    await asyncio.sleep(0.1)
+    assert sorted(upsert.stored) == [1, 2]
+    assert len(buffer) == 0
+
+
+@pytest.mark.asyncio
+async def test_wait_propagates_errors():
+    upsert = FakeUpsert(failures=1)
+    buffer = WriteBehindBuffer(upsert, flush_size=10, flush_interval=0.01)
+    with pytest.raises(ConnectionError):
+        await buffer.add("d", points(1), wait=True)
+    await buffer.add("d", points(2), wait=True)
+    assert sorted(upsert.stored) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_invalid_write_does_not_drop_others():
+    upsert = FakeUpsert()
+    buffer = WriteBehindBuffer(
+        upsert, flush_size=10, flush_interval=0.01, retry_if=not_value_error
+    )
+    results = await asyncio.gather(
+        buffer.add("d", points(1, 2)),
+        buffer.add("d", points(3, size=3), wait=True),
+        buffer.add("d", points(4), wait=True),
+        return_exceptions=True,
+    )
+    assert results[0] is None
+    assert isinstance(results[1], ValueError)
+    assert results[2] is None
+    assert sorted(upsert.stored) == [1, 2, 4]
+    # the invalid write is dropped instead of being retried
+    await asyncio.sleep(0.05)
+    assert len(buffer) == 0
+    assert len(upsert.calls) == 4
+
+
+@pytest.mark.asyncio
+async def test_discard_during_flush():
+    upsert = FakeUpsert(delay=0.05)
+    buffer = WriteBehindBuffer(upsert, flush_size=2, flush_interval=10)
+    await buffer.add("d", points(1, 2))
+    await asyncio.sleep(0.01)
+    await buffer.add("d", points(3))
+    await buffer.discard("d", ids=[3])
+    # the discard waited for the flush in progress, a delete can follow safely
+    assert sorted(upsert.stored) == [1, 2]
+    await buffer.flush()
+    assert sorted(upsert.stored) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_backpressure_while_qdrant_is_down():
+    upsert = FakeUpsert(failures=100)
+    buffer = WriteBehindBuffer(upsert, flush_size=5, flush_interval=10, max_pending=20)
+    for i in range(20):
+        await buffer.add("d", points(i))
+        await asyncio.sleep(0)
+    # the failed batch waits for the timer instead of being retried on every add
+    assert len(upsert.calls) == 1
+    with pytest.raises(BufferFullError):
+        await buffer.add("d", points(20))